@@ -3,7 +3,9 @@ import sys
 
 from bottle import run
 
-from weather_ical.app import app
+from weather_ical.app import app, rendered_calendars
+from weather_ical.data.archive import start_archive_maintenance
+from weather_ical.snapshot import SnapshotError, import_snapshot
 
 
 def main():
@@ -13,6 +15,15 @@ def main():
     server_port = int(os.getenv("PORT", 8080))
     server_address = os.getenv("HOST_ADDRESS", "127.0.0.1")
 
+    start_archive_maintenance()
+
+    # Warm the caches from another instance before serving
+    if snapshot_path := os.getenv("CACHE_SNAPSHOT"):
+        try:
+            import_snapshot(snapshot_path, rendered_calendars)
+        except (SnapshotError, OSError) as e:
+            print(f"Cache snapshot not imported, starting with cold caches: {e}")
+
     print(f"Server started on {server_address}:{server_port}")
     run(app, host=server_address, port=server_port, debug=False)
 
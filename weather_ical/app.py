@@ -1,12 +1,18 @@
-from datetime import timedelta
+import hmac
+import os
+import re
+from datetime import UTC, datetime
 from urllib.parse import urlencode
 
 from bottle import Bottle, HTTPError, request, response
 from requests.exceptions import HTTPError as RequestsHTTPError
 
+from weather_ical.constants import CIRCUIT_BREAKER_RESET_TIMEOUT, MAX_RENDERED_CALENDARS, STALE_IF_ERROR, LRUDict
+from weather_ical.data.breaker import CircuitOpenError, breakers
 from weather_ical.data.client import SimpleHTTPError
 from weather_ical.ical_generator import create_calendar
-from weather_ical.service import generate_weather_data
+from weather_ical.service import WeatherData, generate_weather_data, normalize_zip_codes
+from weather_ical.snapshot import build_snapshot
 
 
 def bool_eval(value) -> bool:
@@ -16,31 +22,65 @@ def bool_eval(value) -> bool:
 
 app = Bottle()
 
+# Last rendered calendar per set of ZIP codes and options, reused while the forecast values are unchanged
+rendered_calendars: LRUDict = LRUDict(MAX_RENDERED_CALENDARS)
+
+
+def set_calendar_headers(weather_data: WeatherData):
+    last_update_dt = weather_data["LastUpdated"]
+    expires_dt = weather_data["Expires"]
+    max_age = max(0, int((expires_dt - datetime.now(UTC)).total_seconds()))
+    stale_if_error = int(STALE_IF_ERROR.total_seconds())
+
+    response.content_type = "text/calendar; charset=utf-8"
+    response.headers["Last-Modified"] = last_update_dt.strftime("%a, %d %b %Y %H:%M:%S GMT")
+    response.headers["Expires"] = expires_dt.strftime("%a, %d %b %Y %H:%M:%S GMT")
+    response.headers["Cache-Control"] = (
+        f"public, max-age={max_age}, stale-while-revalidate=300, stale-if-error={stale_if_error}"
+    )
+
 
 @app.route("/weather")
 def weather_calendar():
+    metric = bool_eval(request.query.get("metric", False))
+    show_location = bool_eval(request.query.get("show_location", False))
+    previous: tuple[WeatherData, bytes] | None = None
+
     try:
+        zip_codes = normalize_zip_codes(request.query.getall("zip"))
+        # The same ZIP codes in any order give the same calendar
+        query_key = (tuple(sorted(zip_codes)), metric, show_location)
+        previous = rendered_calendars.get(query_key)
+
         weather_data = generate_weather_data(
-            zip_code=request.query.get("zip", ""),
-            metric=bool_eval(request.query.get("metric", False)),
-            show_location=bool_eval(request.query.get("show_location", False)),
+            zip_codes=zip_codes,
+            metric=metric,
+            show_location=show_location,
+            previous=previous[0] if previous else None,
         )
 
-        calendar_content = create_calendar(weather_data)
-
-        last_update_dt = weather_data["LastUpdated"]
-        expires_dt = last_update_dt + timedelta(hours=1)
-
-        response.content_type = "text/calendar; charset=utf-8"
-        response.headers["Last-Modified"] = last_update_dt.strftime("%a, %d %b %Y %H:%M:%S GMT")
-        response.headers["Expires"] = expires_dt.strftime("%a, %d %b %Y %H:%M:%S GMT")
-        response.headers["Cache-Control"] = "public, max-age=3600, stale-while-revalidate=300, stale-if-error=86400"
+        if previous and previous[0]["Fingerprint"] == weather_data["Fingerprint"]:
+            calendar_content = previous[1]
+        else:
+            calendar_content = create_calendar(weather_data)
+        rendered_calendars[query_key] = (weather_data, calendar_content)
 
+        set_calendar_headers(weather_data)
         return calendar_content
 
     except SimpleHTTPError as http_err:
         raise HTTPError(http_err.status_code, http_err.content)
 
+    except CircuitOpenError as circuit_err:
+        print(circuit_err)
+        # Serve the last good calendar rather than waiting on an upstream that is known to be failing
+        if previous and datetime.now(UTC) < previous[0]["Expires"] + STALE_IF_ERROR:
+            set_calendar_headers(previous[0])
+            return previous[1]
+
+        retry_after = int(CIRCUIT_BREAKER_RESET_TIMEOUT.total_seconds())
+        raise HTTPError(503, "Service Unavailable", headers={"Retry-After": str(retry_after)})
+
     except RequestsHTTPError as http_err:
         if http_err.response.content:
             response.status = http_err.response.status_code
@@ -58,9 +98,35 @@ def weather_calendar():
         raise HTTPError(500, "Internal Server Error")
 
 
+@app.route("/status")
+def status():
+    return {"breakers": {breaker.name: breaker.status() for breaker in breakers.values()}}
+
+
+@app.route("/admin/snapshot")
+def admin_snapshot():
+    # Disabled unless a token is configured
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPError(404, "Not Found")
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {admin_token}"):
+        raise HTTPError(401, "Unauthorized")
+
+    snapshot = build_snapshot(rendered_calendars)
+
+    response.content_type = "application/octet-stream"
+    response.headers["Content-Disposition"] = 'attachment; filename="cache_snapshot.bin"'
+    return snapshot
+
+
 @app.route("/link")
 def link():
-    query_params = dict(request.query.decode())
+    # Keep repeated keys, and split a form field holding several ZIP codes into one zip parameter each
+    query_params = [
+        (key, value)
+        for key, field in request.query.decode().allitems()
+        for value in (re.split(r"[\s,]+", field.strip()) if key == "zip" else [field])
+    ]
 
     html = f"""
     <!DOCTYPE html>
@@ -91,7 +157,7 @@ def index():
     </head>
     <body>
         <form action="/link" method="get">
-            Zip Code: <input type="text" name="zip" pattern="\\d{5}" inputmode="numeric" required><br>
+            Zip Codes: <input type="text" name="zip" pattern="\\d{5}([\\s,]+\\d{5})*" inputmode="numeric" required><br>
             Units: <br>
             <input type="radio" id="imperial" name="metric" value="false" checked>
             <label for="imperial">Imperial</label><br>
@@ -0,0 +1,169 @@
+"""Compare processing locations one at a time against processing them in one batch.
+
+Usage:
+    python -m weather_ical.benchmark [location counts...]
+
+Responses are synthetic, shaped like the ones requested in service.generate_weather_data.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from weather_ical.constants import FORECAST_DAYS
+from weather_ical.data.processing import process_locations_weather_data
+
+HOURLY_VARIABLES = [
+    "temperature_2m",
+    "relative_humidity_2m",
+    "apparent_temperature",
+    "precipitation_probability",
+    "rain",
+    "showers",
+    "snowfall",
+    "cloud_cover",
+    "wind_speed_10m",
+    "wind_direction_10m",
+    "wind_gusts_10m",
+    "uv_index",
+    "uv_index_clear_sky",
+    "weather_code",
+    "is_day",
+]
+
+# US timezones, including one that is not a whole number of hours from UTC for good measure
+UTC_OFFSETS = [-14400, -18000, -21600, -25200, -28800, -32400, -36000, 19800]
+
+
+class SyntheticVariable:
+    def __init__(self, values):
+        self.values = values
+
+    def ValuesAsNumpy(self):  # noqa: N802
+        return self.values
+
+
+class SyntheticVariablesWithTime:
+    def __init__(self, start: int, interval: int, variables: list):
+        self.start = start
+        self.interval = interval
+        self.variables = variables
+
+    def Time(self):  # noqa: N802
+        return self.start
+
+    def TimeEnd(self):  # noqa: N802
+        return self.start + len(self.variables[0]) * self.interval
+
+    def Interval(self):  # noqa: N802
+        return self.interval
+
+    def Variables(self, i: int):  # noqa: N802
+        return SyntheticVariable(self.variables[i])
+
+    def VariablesLength(self):  # noqa: N802
+        return len(self.variables)
+
+
+class SyntheticResponse:
+    def __init__(self, utc_offset_seconds: int, hourly, minutely_15=None):
+        self.utc_offset_seconds = utc_offset_seconds
+        self.hourly = hourly
+        self.minutely_15 = minutely_15
+
+    def UtcOffsetSeconds(self):  # noqa: N802
+        return self.utc_offset_seconds
+
+    def Hourly(self):  # noqa: N802
+        return self.hourly
+
+    def Minutely15(self):  # noqa: N802
+        return self.minutely_15
+
+
+def make_responses(location_count: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # Responses start at the current hour
+    start = int(time.time()) // 3600 * 3600
+    hours = FORECAST_DAYS * 24
+
+    aqi_responses = []
+    weather_responses = []
+    for location_id in range(location_count):
+        utc_offset_seconds = UTC_OFFSETS[location_id % len(UTC_OFFSETS)]
+
+        hourly_values = []
+        for name in HOURLY_VARIABLES:
+            if name == "weather_code":
+                values = rng.choice([0, 1, 2, 3, 45, 61, 63, 71, 80, 95], hours)
+            elif name == "is_day":
+                values = rng.integers(0, 2, hours)
+            elif name == "wind_direction_10m":
+                values = rng.uniform(0, 360, hours)
+            else:
+                values = rng.uniform(0, 30, hours)
+            hourly_values.append(values.astype(np.float32))
+
+        precipitation = np.where(rng.random(hours * 4) > 0.8, rng.uniform(0, 0.1, hours * 4), 0).astype(np.float32)
+        aqi = rng.uniform(0, 200, hours).astype(np.float32)
+
+        weather_responses.append(
+            SyntheticResponse(
+                utc_offset_seconds,
+                SyntheticVariablesWithTime(start, 3600, hourly_values),
+                SyntheticVariablesWithTime(start, 900, [precipitation]),
+            )
+        )
+        aqi_responses.append(SyntheticResponse(utc_offset_seconds, SyntheticVariablesWithTime(start, 3600, [aqi])))
+
+    return aqi_responses, weather_responses
+
+
+def best_time(func, repeat: int) -> tuple[float, list]:
+    best = float("inf")
+    result = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched multi-location processing")
+    parser.add_argument("location_counts", nargs="*", type=int, default=[1, 10, 50, 100, 250, 500])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    weather_params = {"hourly": HOURLY_VARIABLES}
+
+    print(f"{'locations':>9}  {'one at a time':>15}  {'batched':>15}  {'speedup':>7}")
+    for location_count in args.location_counts:
+        aqi_responses, weather_responses = make_responses(location_count)
+
+        single_time, single_results = best_time(
+            lambda aqi=aqi_responses, weather=weather_responses: [
+                process_locations_weather_data([aqi_response], [weather_response], weather_params, FORECAST_DAYS)[0]
+                for aqi_response, weather_response in zip(aqi, weather, strict=True)
+            ],
+            args.repeat,
+        )
+        batch_time, batch_results = best_time(
+            lambda aqi=aqi_responses, weather=weather_responses: process_locations_weather_data(
+                aqi, weather, weather_params, FORECAST_DAYS
+            ),
+            args.repeat,
+        )
+
+        if not all(batch.equals(single) for batch, single in zip(batch_results, single_results, strict=True)):
+            raise SystemExit(f"Batched results differ from single-location results for {location_count} locations")
+
+        print(
+            f"{location_count:>9}  {location_count / single_time:>11.0f} l/s  {location_count / batch_time:>11.0f} l/s"
+            f"  {single_time / batch_time:>6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
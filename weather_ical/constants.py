@@ -1,4 +1,6 @@
-from typing import Any
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, NamedTuple
 
 
 class RangeDict(dict[range, Any]):
@@ -12,8 +14,77 @@ class RangeDict(dict[range, Any]):
         return super().__getitem__(item)
 
 
+class LRUDict(OrderedDict[Any, Any]):
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return super().__getitem__(key)
+
+    def __setitem__(self, key: Any, value: Any):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        # Drop the least recently used entries
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+class ModelUpdateSchedule(NamedTuple):
+    # How often a new model run is published
+    interval: timedelta
+    # Delay between the nominal run time (aligned to 00 UTC) and the data being available
+    offset: timedelta
+
+
 FORECAST_DAYS = 5
 
+# Most ZIP codes accepted in one calendar request
+MAX_LOCATIONS = 10
+
+# Most rendered calendars kept in memory for reuse
+MAX_RENDERED_CALENDARS = 256
+
+GEOCODING_CACHE_NAME = "geocoding_cache"
+REQUEST_CACHE_NAME = "request_cache"
+
+GEOCODING_API_URL = "https://geocoding-api.open-meteo.com/v1/search"
+FORECAST_API_URL = "https://api.open-meteo.com/v1/forecast"
+AIR_QUALITY_API_URL = "https://air-quality-api.open-meteo.com/v1/air-quality"
+
+# Cached responses expire when the next model run for their endpoint is expected to be published
+MODEL_UPDATE_SCHEDULES = {
+    # Best match for US locations is led by hourly HRRR runs
+    FORECAST_API_URL: ModelUpdateSchedule(interval=timedelta(hours=1), offset=timedelta(minutes=45)),
+    # CAMS global runs at 00 and 12 UTC
+    AIR_QUALITY_API_URL: ModelUpdateSchedule(interval=timedelta(hours=12), offset=timedelta(hours=8)),
+}
+
+# (connect, read) timeouts in seconds for each upstream
+UPSTREAM_TIMEOUTS = {
+    GEOCODING_API_URL: (3.05, 5),
+    FORECAST_API_URL: (3.05, 10),
+    AIR_QUALITY_API_URL: (3.05, 10),
+}
+
+# Consecutive upstream failures before a circuit breaker opens, and how long it stays open
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 3
+CIRCUIT_BREAKER_RESET_TIMEOUT = timedelta(seconds=60)
+
+# How long after expiring cached data may still be served when upstreams are failing
+STALE_IF_ERROR = timedelta(days=1)
+
+# Daily forecasts are archived so days that have passed stay on the calendar
+FORECAST_ARCHIVE_DIR = "forecast_archive"
+ARCHIVE_RETENTION_DAYS = 7
+# Files in a location's archive before they are compacted into one
+ARCHIVE_COMPACTION_THRESHOLD = 48
+# How often expired archive files are removed and each location's files are compacted
+ARCHIVE_MAINTENANCE_INTERVAL = timedelta(hours=6)
+
 WMO_MAP = {
     0: ("Sunny", "\u2600\ufe0f"),
     1: ("Mostly sunny", "\U0001f324\ufe0f"),
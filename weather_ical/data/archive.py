@@ -0,0 +1,166 @@
+import threading
+import time
+from datetime import UTC, date, datetime, timedelta
+from pathlib import Path
+from uuid import uuid4
+
+import polars as pl
+
+from weather_ical.constants import (
+    ARCHIVE_COMPACTION_THRESHOLD,
+    ARCHIVE_MAINTENANCE_INTERVAL,
+    ARCHIVE_RETENTION_DAYS,
+    FORECAST_ARCHIVE_DIR,
+)
+
+_write_lock = threading.Lock()
+
+
+def get_partition(lat: float, lon: float, archive_dir: str = FORECAST_ARCHIVE_DIR) -> Path:
+    """Return the archive directory for a location."""
+    return Path(archive_dir) / f"{lat:.4f}_{lon:.4f}"
+
+
+def select_final_rows(df):
+    """Keep one row per unit system and date, the latest forecast that covered the whole day."""
+    # Responses start at the current hour, so later forecasts for a day only cover its remaining hours
+    return (
+        df.sort("hours_count", "last_updated")
+        .group_by("metric", "date", maintain_order=True)
+        .last()
+        .sort("metric", "date")
+    )
+
+
+def append_daily_rows(
+    lat: float,
+    lon: float,
+    metric: bool,
+    daily_df,
+    last_updated: datetime,
+    utc_offset_seconds: int,
+    tz_abbreviation: str,
+    archive_dir: str = FORECAST_ARCHIVE_DIR,
+):
+    """Append processed daily rows to the location's archive as a new Parquet file."""
+    partition = get_partition(lat, lon, archive_dir)
+    rows = daily_df.with_columns(
+        pl.lit(metric).alias("metric"),
+        pl.lit(last_updated).dt.convert_time_zone("UTC").alias("last_updated"),
+        pl.lit(utc_offset_seconds, dtype=pl.Int32).alias("utc_offset_seconds"),
+        pl.lit(tz_abbreviation).alias("timezone_abbreviation"),
+    )
+
+    with _write_lock:
+        partition.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary name first so readers never see a partial file
+        part_path = partition / f"part-{last_updated:%Y%m%d%H%M%S}-{uuid4().hex[:8]}.parquet"
+        tmp_path = part_path.with_suffix(".tmp")
+        rows.write_parquet(tmp_path)
+        tmp_path.replace(part_path)
+
+        if len(list(partition.glob("*.parquet"))) >= ARCHIVE_COMPACTION_THRESHOLD:
+            compact_partition(partition)
+
+
+def read_past_days(
+    lat: float,
+    lon: float,
+    metric: bool,
+    today: date,
+    retention_days: int = ARCHIVE_RETENTION_DAYS,
+    archive_dir: str = FORECAST_ARCHIVE_DIR,
+):
+    """Return the final archived rows for the days before today, up to retention_days back."""
+    # Compaction and sweeping delete files, hold the lock until the ones listed have been read
+    with _write_lock:
+        files = sorted(get_partition(lat, lon, archive_dir).glob("*.parquet"))
+        if not files:
+            return pl.DataFrame()
+
+        past_rows = (
+            pl.scan_parquet(files)
+            .filter(
+                pl.col("metric") == metric,
+                pl.col("date") < pl.lit(today),
+                pl.col("date") >= pl.lit(today - timedelta(days=retention_days)),
+            )
+            .collect()
+        )
+
+    return select_final_rows(past_rows)
+
+
+def compact_partition(partition: Path, retention_days: int = ARCHIVE_RETENTION_DAYS):
+    """Rewrite a location's archive as one file holding only the final rows within retention."""
+    files = sorted(partition.glob("*.parquet"))
+    if not files:
+        return
+
+    # Dates are local to the location, allow a day of slack when comparing with UTC
+    cutoff = datetime.now(UTC).date() - timedelta(days=retention_days + 1)
+    compacted = select_final_rows(pl.read_parquet(files).filter(pl.col("date") >= pl.lit(cutoff)))
+
+    if compacted.is_empty():
+        for file in files:
+            file.unlink()
+        partition.rmdir()
+        return
+
+    compacted_path = partition / f"compacted-{uuid4().hex[:8]}.parquet"
+    tmp_path = compacted_path.with_suffix(".tmp")
+    compacted.write_parquet(tmp_path)
+    tmp_path.replace(compacted_path)
+
+    for file in files:
+        file.unlink()
+
+
+def compact_archive(archive_dir: str = FORECAST_ARCHIVE_DIR, retention_days: int = ARCHIVE_RETENTION_DAYS):
+    """Compact every location's archive that has more than one file."""
+    root = Path(archive_dir)
+    if not root.is_dir():
+        return
+
+    with _write_lock:
+        for partition in root.iterdir():
+            if partition.is_dir() and len(list(partition.glob("*.parquet"))) > 1:
+                compact_partition(partition, retention_days)
+
+
+def sweep_archive(archive_dir: str = FORECAST_ARCHIVE_DIR, retention_days: int = ARCHIVE_RETENTION_DAYS):
+    """Delete archive files that only hold days past retention, without rewriting any others."""
+    root = Path(archive_dir)
+    if not root.is_dir():
+        return
+
+    cutoff = datetime.now(UTC).date() - timedelta(days=retention_days + 1)
+
+    with _write_lock:
+        for file in root.glob("*/*.parquet"):
+            newest_date = pl.scan_parquet(file).select(pl.col("date").max()).collect().item()
+            if newest_date is None or newest_date < cutoff:
+                file.unlink()
+
+        for partition in root.iterdir():
+            if partition.is_dir() and not any(partition.iterdir()):
+                partition.rmdir()
+
+
+def start_archive_maintenance(
+    interval: timedelta = ARCHIVE_MAINTENANCE_INTERVAL, archive_dir: str = FORECAST_ARCHIVE_DIR
+) -> threading.Thread:
+    """Sweep and compact the archive in a background thread, now and then once every interval."""
+
+    def maintain():
+        while True:
+            try:
+                sweep_archive(archive_dir)
+                compact_archive(archive_dir)
+            except (OSError, pl.exceptions.PolarsError) as e:
+                print(f"Forecast archive maintenance failed: {e}")
+            time.sleep(interval.total_seconds())
+
+    thread = threading.Thread(target=maintain, name="archive-maintenance", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,109 @@
+import threading
+from collections import deque
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+from requests.exceptions import HTTPError, RequestException
+
+from weather_ical.constants import (
+    AIR_QUALITY_API_URL,
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    CIRCUIT_BREAKER_RESET_TIMEOUT,
+    FORECAST_API_URL,
+    GEOCODING_API_URL,
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str):
+        super().__init__(f"Circuit breaker for {name} is open")
+        self.name = name
+
+
+class CircuitBreaker:
+    """Tracks consecutive failures of an upstream and stops sending requests to it while open"""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: timedelta = CIRCUIT_BREAKER_RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at: datetime | None = None
+        # When the one request allowed through while half open was sent
+        self.trial_started_at: datetime | None = None
+        self.transitions: deque[tuple[datetime, str, str]] = deque(maxlen=50)
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str):
+        now = datetime.now(UTC)
+        print(f"Circuit breaker {self.name}: {self.state} -> {state}")
+        self.transitions.append((now, self.state, state))
+        self.state = state
+        self.opened_at = now if state == OPEN else None
+        self.trial_started_at = None
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            now = datetime.now(UTC)
+            if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+                self._transition(HALF_OPEN)
+
+            if self.state == HALF_OPEN:
+                # Let a single trial request through, its result decides whether to close or reopen.
+                # A trial that never reports back (e.g. it was answered from cache) is replaced after reset_timeout.
+                if self.trial_started_at and now - self.trial_started_at < self.reset_timeout:
+                    return False
+                self.trial_started_at = now
+                return True
+
+            return self.state == CLOSED
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self._transition(OPEN)
+
+    def status(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "opened_at": self.opened_at.isoformat() if self.opened_at else None,
+                "transitions": [
+                    {"time": time.isoformat(), "from": from_state, "to": to_state}
+                    for time, from_state, to_state in self.transitions
+                ],
+            }
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """Whether exc means the upstream is unavailable, as opposed to it rejecting the request."""
+    # openmeteo_requests wraps the underlying requests exception
+    cause = exc.__cause__ or exc
+    if isinstance(cause, HTTPError) and cause.response is not None:
+        return cause.response.status_code >= 500
+    return isinstance(cause, RequestException)
+
+
+breakers = {
+    GEOCODING_API_URL: CircuitBreaker("geocoding"),
+    FORECAST_API_URL: CircuitBreaker("forecast"),
+    AIR_QUALITY_API_URL: CircuitBreaker("air_quality"),
+}
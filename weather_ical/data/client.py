@@ -1,8 +1,18 @@
+from datetime import UTC, datetime
 from typing import Any, cast, TYPE_CHECKING
 
 import openmeteo_requests
 from requests_cache import CachedSession
 
+from weather_ical.constants import (
+    MODEL_UPDATE_SCHEDULES,
+    REQUEST_CACHE_NAME,
+    STALE_IF_ERROR,
+    UPSTREAM_TIMEOUTS,
+    ModelUpdateSchedule,
+)
+from weather_ical.data.breaker import CircuitOpenError, breakers, is_upstream_failure
+
 if TYPE_CHECKING:
     from niquests import Session
 
@@ -13,11 +23,26 @@ class SimpleHTTPError(Exception):
         self.content = content
 
 
+def next_model_update(schedule: ModelUpdateSchedule, now: datetime | None = None) -> datetime:
+    """Returns the time at which the next model run is expected to be available."""
+    now = now or datetime.now(UTC)
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    runs_elapsed = (now - day_start - schedule.offset) // schedule.interval
+
+    return day_start + schedule.offset + (runs_elapsed + 1) * schedule.interval
+
+
 class WeatherClient:
     """Weather client that captures cache metadata using response hooks"""
 
-    def __init__(self, cache_name: str = "request_cache", expire_after: int = 3600):
+    def __init__(
+        self,
+        cache_name: str = REQUEST_CACHE_NAME,
+        expire_after: int = 3600,
+        update_schedules: dict[str, ModelUpdateSchedule] | None = None,
+    ):
         self.cache_info: dict[str, Any] = {}
+        self.update_schedules = MODEL_UPDATE_SCHEDULES if update_schedules is None else update_schedules
         self.session = self._create_session(cache_name, expire_after)
         self.openmeteo = openmeteo_requests.Client(session=cast("Session", cast("object", self.session)))
 
@@ -30,13 +55,50 @@ class WeatherClient:
         if hasattr(response, "from_cache"):
             self.cache_info["from_cache"] = response.from_cache
 
+        if getattr(response, "expires", None):
+            self.cache_info["expires"] = response.expires
+
+        # Only set on cached responses, an expired one is served when refreshing it failed
+        if hasattr(response, "is_expired"):
+            self.cache_info["is_expired"] = response.is_expired
+
     def _create_session(self, cache_name: str, expire_after: int) -> CachedSession:
-        cache_session = CachedSession(cache_name, expire_after=expire_after, stale_if_error=86400)
+        cache_session = CachedSession(
+            cache_name, expire_after=expire_after, stale_if_error=int(STALE_IF_ERROR.total_seconds())
+        )
 
         cache_session.hooks["response"].append(self._capture_cache_metadata)
 
         return cache_session
 
+    def get_expiration(self, url: str) -> datetime | None:
+        """Returns the expiration for a fresh response from url, or None to use the session default."""
+        schedule = self.update_schedules.get(url)
+        return next_model_update(schedule) if schedule else None
+
     def get_weather(self, url: str, params: dict[str, Any]) -> tuple[list[Any], dict[str, Any]]:
-        responses = self.openmeteo.weather_api(url, params=params)
+        breaker = breakers[url]
+        kwargs: dict[str, Any] = {"timeout": UPSTREAM_TIMEOUTS[url]}
+        if expires := self.get_expiration(url):
+            kwargs["expire_after"] = expires
+
+        # While the breaker is not letting requests through only cached responses are served, anything else fails
+        # fast. That includes expired ones still within STALE_IF_ERROR, for which set_calendar_headers sends max-age=0
+        only_if_cached = not breaker.allow_request()
+
+        try:
+            responses = self.openmeteo.weather_api(url, params=params, only_if_cached=only_if_cached, **kwargs)
+        except Exception as e:
+            if only_if_cached:
+                raise CircuitOpenError(breaker.name) from e
+            if is_upstream_failure(e):
+                breaker.record_failure()
+            raise
+
+        if not only_if_cached:
+            if self.cache_info.get("is_expired"):
+                breaker.record_failure()
+            elif not self.cache_info.get("from_cache"):
+                breaker.record_success()
+
         return responses, self.cache_info.copy()
@@ -1,75 +1,93 @@
-from datetime import datetime, timedelta, timezone
+import hashlib
 
 import numpy as np
 import polars as pl
 
 
-def get_timezone_info(response):
-    """Extract timezone information from API response."""
-    utc_offset_seconds = response.UtcOffsetSeconds()
-    offset_hours = utc_offset_seconds // 3600
-    offset_minutes = abs(utc_offset_seconds % 3600) // 60
-    polars_tz = f"{offset_hours:+03d}:{offset_minutes:02d}"
-    location_timezone = timezone(timedelta(seconds=utc_offset_seconds))
-    return polars_tz, location_timezone
+def create_stacked_dataframe(time_objs, utc_offsets, variable_names=None):
+    """Stack API time objects of several locations into one DataFrame keyed by location_id."""
+    lengths = []
+    local_timestamps = []
+    columns = {}
+    for time_obj, utc_offset_seconds in zip(time_objs, utc_offsets, strict=True):
+        # Offsetting the epoch gives naive local timestamps, so locations in different timezones share a column
+        timestamps = np.arange(time_obj.Time(), time_obj.TimeEnd(), time_obj.Interval()) + utc_offset_seconds
+        lengths.append(len(timestamps))
+        local_timestamps.append(timestamps)
+        for i in range(time_obj.VariablesLength()):
+            key = variable_names[i] if variable_names and i < len(variable_names) else f"var_{i}"
+            columns.setdefault(key, []).append(time_obj.Variables(i).ValuesAsNumpy())
 
+    data_dict = {
+        "location_id": np.repeat(np.arange(len(lengths), dtype=np.uint32), lengths),
+        "local_datetime": pl.from_epoch(pl.Series(np.concatenate(local_timestamps), dtype=pl.Int64), time_unit="s"),
+    }
+    for key, values in columns.items():
+        data_dict[key] = np.concatenate(values)
 
-def create_timestamps(time_obj, location_timezone):
-    """Create local timestamps from API time object."""
-    timestamps = np.arange(time_obj.Time(), time_obj.TimeEnd(), time_obj.Interval())
-    return [datetime.fromtimestamp(ts, tz=timezone.utc).astimezone(location_timezone) for ts in timestamps]
+    return pl.DataFrame(data_dict)
 
 
-def create_hourly_dataframe(response, location_timezone, polars_tz, variable_names=None):
+def create_hourly_dataframe(responses, variable_names=None):
     """Create DataFrame from hourly weather data."""
-    hourly = response.Hourly()
-    local_timestamps = create_timestamps(hourly, location_timezone)
-
-    data_dict = {"local_datetime": local_timestamps}
-    for i in range(hourly.VariablesLength()):
-        key = variable_names[i] if variable_names and i < len(variable_names) else f"var_{i}"
-        data_dict[key] = hourly.Variables(i).ValuesAsNumpy()
-
-    return pl.DataFrame(data_dict).with_columns(pl.col("local_datetime").dt.convert_time_zone(polars_tz))
+    return create_stacked_dataframe(
+        [response.Hourly() for response in responses],
+        [response.UtcOffsetSeconds() for response in responses],
+        variable_names,
+    )
 
 
-def create_minutely_dataframe(response, location_timezone, polars_tz):
+def create_minutely_dataframe(responses):
     """Create DataFrame from 15-minute precipitation data."""
-    minutely_15 = response.Minutely15()
-    local_timestamps = create_timestamps(minutely_15, location_timezone)
-    precipitation_data = minutely_15.Variables(0).ValuesAsNumpy()
+    return create_stacked_dataframe(
+        [response.Minutely15() for response in responses],
+        [response.UtcOffsetSeconds() for response in responses],
+        ["precipitation"],
+    )
 
-    data_dict = {"local_datetime": local_timestamps, "precipitation": precipitation_data}
-    return pl.DataFrame(data_dict).with_columns(pl.col("local_datetime").dt.convert_time_zone(polars_tz))
 
+def fingerprint_responses(*responses):
+    """Hash the time axes and values of API responses, ignoring per-request metadata like generation time.
 
-def calculate_vector_wind_direction(directions, speeds):
-    """Calculate vector average wind direction weighted by wind speed."""
-    directions_rad = np.radians(directions)
-    x_component = np.sum(speeds * np.cos(directions_rad))
-    y_component = np.sum(speeds * np.sin(directions_rad))
-    avg_direction_rad = np.arctan2(y_component, x_component)
-    avg_direction = np.degrees(avg_direction_rad)
-    return avg_direction + 360 if avg_direction < 0 else avg_direction
+    The time axis moves with every model run, so this only identifies payloads served from the same cache entries.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for response in responses:
+        digest.update(response.UtcOffsetSeconds().to_bytes(4, "little", signed=True))
+        for time_obj in (response.Hourly(), response.Minutely15()):
+            if time_obj is None:
+                continue
+            digest.update(np.array([time_obj.Time(), time_obj.TimeEnd(), time_obj.Interval()]).tobytes())
+            for i in range(time_obj.VariablesLength()):
+                digest.update(time_obj.Variables(i).ValuesAsNumpy().tobytes())
+    return digest.hexdigest()
 
 
 def get_daily_wind_vectors(df):
-    """Calculate daily vector-averaged wind directions."""
-    wind_data = []
-    for date in df.select("date").unique().to_series():
-        day_data = df.filter(pl.col("date") == date)
-        directions = day_data.select("wind_direction_10m").to_numpy().flatten()
-        speeds = day_data.select("wind_speed_10m").to_numpy().flatten()
+    """Calculate daily vector-averaged wind directions, weighted by wind speed."""
+    valid = pl.col("wind_direction_10m").is_not_nan() & pl.col("wind_speed_10m").is_not_nan()
+    directions_rad = pl.col("wind_direction_10m").cast(pl.Float64).radians()
+    speeds = pl.col("wind_speed_10m").cast(pl.Float64)
+    avg_direction = pl.arctan2(pl.col("y_component"), pl.col("x_component")).degrees()
 
-        valid_mask = np.logical_not(np.isnan(directions) | np.isnan(speeds))
-        if valid_mask.any():
-            vector_avg = calculate_vector_wind_direction(directions[valid_mask], speeds[valid_mask])
-        else:
-            vector_avg = float("nan")
-
-        wind_data.append({"date": date, "vector_avg_wind_direction_10m": vector_avg})
-
-    return pl.DataFrame(wind_data)
+    return (
+        df.group_by("location_id", "date")
+        .agg(
+            (speeds * directions_rad.cos()).filter(valid).sum().alias("x_component"),
+            (speeds * directions_rad.sin()).filter(valid).sum().alias("y_component"),
+            valid.sum().alias("valid_count"),
+        )
+        .select(
+            "location_id",
+            "date",
+            pl.when(pl.col("valid_count") == 0)
+            .then(float("nan"))
+            .when(avg_direction < 0)
+            .then(avg_direction + 360)
+            .otherwise(avg_direction)
+            .alias("vector_avg_wind_direction_10m"),
+        )
+    )
 
 
 def get_daily_precipitation_data(minutely_df):
@@ -77,22 +95,24 @@ def get_daily_precipitation_data(minutely_df):
     return (
         minutely_df.with_columns(pl.col("local_datetime").dt.date().alias("date"))
         .filter(pl.col("precipitation") > 0)
-        .group_by("date")
+        .group_by("location_id", "date")
         .agg(
             pl.col("precipitation").count().alias("precipitation_intervals"),
             pl.col("precipitation").sum().alias("precipitation_sum"),
         )
         .with_columns((pl.col("precipitation_intervals") * 15 / 60).alias("precipitation_hours"))
-        .select(["date", "precipitation_hours", "precipitation_sum"])
+        .select(["location_id", "date", "precipitation_hours", "precipitation_sum"])
     )
 
 
-def aggregate_daily_data(df, end_date):
+def aggregate_daily_data(df, forecast_days):
     """Aggregate hourly weather data to daily statistics."""
+    # Each location's forecast starts on its own current local date
+    end_date = pl.col("date").min().over("location_id") + pl.duration(days=forecast_days - 1)
     return (
         df.with_columns(pl.col("local_datetime").dt.date().alias("date"))
-        .filter(pl.col("date") <= pl.lit(end_date))
-        .group_by("date")
+        .filter(pl.col("date") <= end_date)
+        .group_by("location_id", "date")
         .agg(
             pl.col("us_aqi").max().alias("aqi_max"),
             pl.col("temperature_2m").min().alias("temperature_min"),
@@ -112,7 +132,7 @@ def aggregate_daily_data(df, end_date):
             pl.col("us_aqi").count().alias("hours_count"),
             pl.col("is_day").sum().alias("daylight_hours"),
         )
-        .sort("date")
+        .sort("location_id", "date")
     )
 
 
@@ -138,33 +158,44 @@ def round_final_data(df):
     )
 
 
-def process_weather_data(aqi_response, weather_response, weather_params, forecast_days=5):
-    """Main function to process weather and air quality data."""
+def process_weather_data(aqi_responses, weather_responses, weather_params, forecast_days=5):
+    """Main function to process weather and air quality data.
 
-    # Get timezone info
-    polars_tz, location_timezone = get_timezone_info(aqi_response)
+    Takes one response per location from each API, in the same order, and processes all locations together.
+    Rows of the result are identified by location_id, the index of their location in the response lists.
+    """
 
     # Create DataFrames
-    aqi_df = create_hourly_dataframe(aqi_response, location_timezone, polars_tz, ["us_aqi"])
-    weather_df = create_hourly_dataframe(weather_response, location_timezone, polars_tz, weather_params["hourly"])
-    minutely_df = create_minutely_dataframe(weather_response, location_timezone, polars_tz)
+    aqi_df = create_hourly_dataframe(aqi_responses, ["us_aqi"])
+    weather_df = create_hourly_dataframe(weather_responses, weather_params["hourly"])
+    minutely_df = create_minutely_dataframe(weather_responses)
 
     # Join hourly data
-    df = aqi_df.join(weather_df, on="local_datetime", how="inner")
+    df = aqi_df.join(weather_df, on=["location_id", "local_datetime"], how="inner")
 
     # Calculate aggregations
-    current_local_date = df.select(pl.col("local_datetime").dt.date().min()).item()
-    end_date = current_local_date + timedelta(days=forecast_days - 1)
-
-    daily_data = aggregate_daily_data(df, end_date)
+    daily_data = aggregate_daily_data(df, forecast_days)
     wind_vector_df = get_daily_wind_vectors(df.with_columns(pl.col("local_datetime").dt.date().alias("date")))
     minutely_daily = get_daily_precipitation_data(minutely_df)
 
     # Join and finalize
     final_data = (
-        daily_data.join(wind_vector_df, on="date", how="left")
-        .join(minutely_daily, on="date", how="left")
+        daily_data.join(wind_vector_df, on=["location_id", "date"], how="left")
+        .join(minutely_daily, on=["location_id", "date"], how="left")
         .with_columns(pl.col("precipitation_hours").fill_null(0.0), pl.col("precipitation_sum").fill_null(0.0))
     )
 
     return round_final_data(final_data)
+
+
+def split_by_location(df, location_count):
+    """Split processed data into one daily DataFrame per location_id, in location order."""
+    partitions = df.partition_by("location_id", as_dict=True, include_key=False)
+    empty = df.clear().drop("location_id")
+    return [partitions.get((location_id,), empty) for location_id in range(location_count)]
+
+
+def process_locations_weather_data(aqi_responses, weather_responses, weather_params, forecast_days=5):
+    """Process all locations in one pass and return their daily DataFrames in the order of the responses."""
+    final_data = process_weather_data(aqi_responses, weather_responses, weather_params, forecast_days)
+    return split_by_location(final_data, len(weather_responses))
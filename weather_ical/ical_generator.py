@@ -6,7 +6,6 @@ from icalendar import Calendar, Event
 
 def create_calendar(weather_data_dict):
     location = weather_data_dict["LocationString"]
-    geo = weather_data_dict["LocationGeo"]
 
     cal = Calendar()
 
@@ -22,8 +21,17 @@ def create_calendar(weather_data_dict):
     cal.add("COLOR", "gold")
     cal.add("X-APPLE-CALENDAR-COLOR", "#ffdc00")
 
-    for forecast_data in weather_data_dict["ForecastEntries"]:
+    # Fresh forecasts take precedence over archived ones for the same day and location
+    fresh_days = {(forecast_data[0], forecast_data[3]) for forecast_data in weather_data_dict["ForecastEntries"]}
+    archived_entries = [
+        forecast_data
+        for forecast_data in weather_data_dict.get("ArchivedEntries", [])
+        if (forecast_data[0], forecast_data[3]) not in fresh_days
+    ]
+
+    for forecast_data in [*archived_entries, *weather_data_dict["ForecastEntries"]]:
         forecast_datetime = forecast_data[0]
+        geo = forecast_data[4]
 
         event = Event()
         event.add("X-MICROSOFT-CDO-ALLDAYEVENT", "TRUE")
@@ -43,7 +51,7 @@ def create_calendar(weather_data_dict):
         event.add("dtstamp", datetime.now(UTC))
         event.add("LAST-MODIFIED", weather_data_dict["LastUpdated"])
         if geo:
-            event.add("LOCATION", location)
+            event.add("LOCATION", forecast_data[3])
             event.add("GEO", geo)
 
         cal.add_component(event)
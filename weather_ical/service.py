@@ -1,9 +1,26 @@
-from datetime import UTC, datetime, timedelta, timezone
-from typing import TypedDict
+import hashlib
+from datetime import UTC, date, datetime, timedelta, timezone
+from typing import Any, TypedDict
 
+import polars as pl
+from requests.exceptions import RequestException
 from requests_cache import NEVER_EXPIRE, CachedSession
 
-from weather_ical.constants import AQI_MAP, FORECAST_DAYS, UVI_MAP, WIND_DIR_MAP, WMO_MAP
+from weather_ical.constants import (
+    AIR_QUALITY_API_URL,
+    AQI_MAP,
+    FORECAST_API_URL,
+    FORECAST_DAYS,
+    GEOCODING_API_URL,
+    GEOCODING_CACHE_NAME,
+    MAX_LOCATIONS,
+    UPSTREAM_TIMEOUTS,
+    UVI_MAP,
+    WIND_DIR_MAP,
+    WMO_MAP,
+)
+from weather_ical.data.archive import append_daily_rows, read_past_days
+from weather_ical.data.breaker import CircuitOpenError, breakers, is_upstream_failure
 from weather_ical.data.client import SimpleHTTPError, WeatherClient
 from weather_ical.data.formatting import (
     clean_description,
@@ -11,19 +28,27 @@ from weather_ical.data.formatting import (
     format_precipitation_description,
     validate_zip,
 )
-from weather_ical.data.processing import process_weather_data
+from weather_ical.data.processing import fingerprint_responses, process_locations_weather_data
+
+# Date, summary, description, location name and location coordinates if shown
+ForecastEntry = tuple[date, str, str, str, tuple[float, float] | None]
 
 
 class WeatherData(TypedDict):
     LastUpdated: datetime
-    ForecastEntries: list[tuple[datetime, str, str]]
+    Expires: datetime
+    # Hash of the upstream payloads, only matches when they were served from the same cache entries
+    ResponseFingerprint: str
+    # Hash of the calendar entries without their "Updated" line, matches across refreshes with the same values
+    Fingerprint: str
+    ForecastEntries: list[ForecastEntry]
+    ArchivedEntries: list[ForecastEntry]
     LocationString: str
-    LocationGeo: tuple[float, float] | None
 
 
 def get_location_from_zip(zip_code: str) -> tuple[float, float, str]:
     geocoding_session = CachedSession(
-        "geocoding_cache",
+        GEOCODING_CACHE_NAME,
         expire_after=NEVER_EXPIRE,
         stale_if_error=True,
     )
@@ -34,8 +59,26 @@ def get_location_from_zip(zip_code: str) -> tuple[float, float, str]:
         "countryCode": "US",
     }
 
-    resp = geocoding_session.get("https://geocoding-api.open-meteo.com/v1/search", params=params)
-    resp.raise_for_status()
+    breaker = breakers[GEOCODING_API_URL]
+    only_if_cached = not breaker.allow_request()
+
+    try:
+        resp = geocoding_session.get(
+            GEOCODING_API_URL,
+            params=params,
+            timeout=UPSTREAM_TIMEOUTS[GEOCODING_API_URL],
+            only_if_cached=only_if_cached,
+        )
+        resp.raise_for_status()
+    except RequestException as e:
+        if only_if_cached:
+            raise CircuitOpenError(breaker.name) from e
+        if is_upstream_failure(e):
+            breaker.record_failure()
+        raise
+
+    if not resp.from_cache:
+        breaker.record_success()
     location = resp.json()["results"][0]
 
     print(f"Geocoding data cache hit: {resp.from_cache}")
@@ -45,7 +88,102 @@ def get_location_from_zip(zip_code: str) -> tuple[float, float, str]:
     return location["latitude"], location["longitude"], location_name
 
 
-def generate_weather_data(zip_code: str, metric: bool, show_location: bool) -> WeatherData:
+def format_updated(last_updated: datetime, tz_abbreviation: str) -> str:
+    return f"{datetime.strftime(last_updated, '%a, %d %b %Y %I:%M%p')} {tz_abbreviation}"
+
+
+def format_forecast_entry(forecast: dict[str, Any], metric: bool) -> tuple[date, str, str]:
+    temp_unit, precip_unit, wind_speed_unit = ("C", "mm", "m/s") if metric else ("F", "in", "mph")
+    precip_cutoff = 0.25 if metric else 0.01
+
+    temp_max = forecast["temperature_max"]
+    temp_min = forecast["temperature_min"]
+    adj_temp_max = forecast["apparent_temperature_max"]
+    adj_temp_min = forecast["apparent_temperature_min"]
+    wmo_code = forecast["wmo"]
+    wmo = WMO_MAP[wmo_code]
+    weather_description = wmo[0]
+    weather_icon = wmo[1]
+    aqi = forecast["aqi_max"]
+    uvi = forecast["uv_index_max"]
+    wind_dir = forecast["vector_avg_wind_direction_10m"]
+
+    if wmo_code in [0, 1] and forecast["daylight_hours"] == 0:
+        weather_description = weather_description.replace("Sunny", "Clear")
+        weather_description = weather_description.replace("sunny", "clear")
+        weather_icon = "\U0001f319\ufe0f"
+
+    summary = f"{weather_icon} {temp_max:.0f}° | {temp_min:.0f}°, {weather_description}"
+
+    precip_description, max_precipitation = format_precipitation_description(forecast, precip_cutoff, precip_unit)
+
+    if max_precipitation > 0:
+        summary += f" ({format_float(max_precipitation)} {precip_unit})"
+
+    description = f"""\
+    Temperature: {temp_min:.0f}°{temp_unit} … {temp_max:.0f}°{temp_unit}
+    Feels like: {adj_temp_min:.0f}°{temp_unit} … {adj_temp_max:.0f}°{temp_unit}
+    Humidity: {forecast["relative_humidity_max"]:.0f}%
+
+    Air quality: {AQI_MAP[aqi]} ({aqi})
+    UV index: {UVI_MAP[uvi]} ({uvi})
+    Cloud cover: {forecast["cloud_cover_mean"]:.0f}%
+
+    {precip_description}
+
+    Wind: {forecast["wind_speed_mean"]} {wind_speed_unit} {WIND_DIR_MAP[wind_dir]} ({wind_dir}°)
+    Wind gust: {forecast["wind_gusts_max"]} {wind_speed_unit}
+
+    Weather data by Open-Meteo.com, CC BY 4.0
+    """
+
+    return forecast["date"], summary, clean_description(description)
+
+
+def label_entry(
+    entry: tuple[date, str, str],
+    updated: str,
+    location_string: str,
+    location_geo: tuple[float, float] | None,
+    prefix: bool,
+) -> ForecastEntry:
+    forecast_date, summary, description = entry
+    if prefix:
+        summary = f"{location_string}: {summary}"
+    description = f"{description}\n\nUpdated: {updated}"
+    return forecast_date, summary, description, location_string, location_geo
+
+
+def fingerprint_entries(entries: list[tuple[date, str, str, str]]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for entry in entries:
+        digest.update(repr(entry).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def as_utc(dt: datetime) -> datetime:
+    # requests-cache may return naive UTC datetimes depending on version
+    return dt.replace(tzinfo=UTC) if dt.tzinfo is None else dt.astimezone(UTC)
+
+
+def normalize_zip_codes(zip_codes: list[str]) -> list[str]:
+    zip_codes_validated = [validate_zip(zip_code) for zip_code in zip_codes]
+
+    if not zip_codes_validated or not all(zip_codes_validated):
+        raise SimpleHTTPError(400, "Invalid or missing ZIP code")
+
+    # Keep the first occurrence of each ZIP code
+    zip_codes_validated = list(dict.fromkeys(zip_codes_validated))
+
+    if len(zip_codes_validated) > MAX_LOCATIONS:
+        raise SimpleHTTPError(400, f"Too many ZIP codes, at most {MAX_LOCATIONS} are allowed")
+
+    return zip_codes_validated
+
+
+def generate_weather_data(
+    zip_codes: list[str], metric: bool, show_location: bool, previous: WeatherData | None = None
+) -> WeatherData:
     if metric:
         temp_unit = "celsius"
         precip_unit = "mm"
@@ -55,30 +193,34 @@ def generate_weather_data(zip_code: str, metric: bool, show_location: bool) -> W
         precip_unit = "inch"
         wind_speed_unit = "mph"
 
-    zip_code_validated = validate_zip(zip_code)
+    zip_codes_validated = normalize_zip_codes(zip_codes)
 
-    if not zip_code_validated:
-        raise SimpleHTTPError(400, "Invalid or missing ZIP code")
+    locations = []
+    for zip_code_validated in zip_codes_validated:
+        lat, lon, location_string = get_location_from_zip(zip_code_validated)
+        locations.append((lat, lon, location_string))
 
-    lat, lon, location_string = get_location_from_zip(zip_code_validated)
-    location_geo = (lat, lon) if show_location else None
+        print(f"Got coordinates ({lat}, {lon}) from {zip_code_validated}")
 
-    print(f"Got coordinates ({lat}, {lon}) from {zip_code_validated}")
+    latitudes = [lat for lat, _, _ in locations]
+    longitudes = [lon for _, lon, _ in locations]
 
     client = WeatherClient()
 
+    # All locations are requested at once, the API returns one response per location in the same order
     aqi_params = {
-        "latitude": lat,
-        "longitude": lon,
+        "latitude": latitudes,
+        "longitude": longitudes,
         "hourly": "us_aqi",
         "timezone": "auto",
-        "forecast_days": FORECAST_DAYS,
+        # Air quality is cached across local midnight, one more day keeps it covering the forecast window after it
+        "forecast_days": FORECAST_DAYS + 1,
         "domains": "cams_global",
         "past_hours": 0,
     }
     weather_params = {
-        "latitude": lat,
-        "longitude": lon,
+        "latitude": latitudes,
+        "longitude": longitudes,
         "hourly": [
             "temperature_2m",
             "relative_humidity_2m",
@@ -105,90 +247,92 @@ def generate_weather_data(zip_code: str, metric: bool, show_location: bool) -> W
         "past_hours": 0,
         "past_minutely_15": 0,
     }
-    weather_responses, weather_cache_metadata = client.get_weather(
-        "https://api.open-meteo.com/v1/forecast", weather_params
-    )
-    aqi_responses, aqi_cache_metadata = client.get_weather(
-        "https://air-quality-api.open-meteo.com/v1/air-quality", aqi_params
-    )
-
-    weather_response = weather_responses[0]
-    aqi_response = aqi_responses[0]
-    tz_abbreviation = weather_response.TimezoneAbbreviation().decode("utf-8")
+    weather_responses, weather_cache_metadata = client.get_weather(FORECAST_API_URL, weather_params)
+    aqi_responses, aqi_cache_metadata = client.get_weather(AIR_QUALITY_API_URL, aqi_params)
 
     print(f"Forecast data cache hit: {weather_cache_metadata.get('from_cache', False)}")
     print(f"Air quality data cache hit: {aqi_cache_metadata.get('from_cache', False)}")
 
+    # The calendar is stale as soon as either endpoint is due for a new model run
+    expires = min(
+        as_utc(metadata["expires"]) if metadata.get("expires") else client.get_expiration(url)
+        for metadata, url in ((weather_cache_metadata, FORECAST_API_URL), (aqi_cache_metadata, AIR_QUALITY_API_URL))
+    )
+
+    # Cache hits return the same payloads, reuse the previous result instead of processing again
+    response_fingerprint = fingerprint_responses(*weather_responses, *aqi_responses)
+    if previous and previous["ResponseFingerprint"] == response_fingerprint:
+        print("Forecast data served from cache, skipping processing")
+        return {**previous, "Expires": expires}
+
     # created_at is None when cache is first initialized
     if not weather_cache_metadata.get("created_at"):
         forecast_cache_last_updated = datetime.now(UTC)
     else:
-        forecast_cache_last_updated = weather_cache_metadata["created_at"].replace(tzinfo=UTC)
+        forecast_cache_last_updated = as_utc(weather_cache_metadata["created_at"])
 
     weather_data_dict: WeatherData = {
         "LastUpdated": forecast_cache_last_updated,
+        "Expires": expires,
+        "ResponseFingerprint": response_fingerprint,
+        "Fingerprint": "",
         "ForecastEntries": [],
-        "LocationString": location_string,
-        "LocationGeo": location_geo,
+        "ArchivedEntries": [],
+        "LocationString": "; ".join(location_string for _, _, location_string in locations),
     }
 
-    # Forecast local timezone
-    forecast_timezone = timezone(timedelta(seconds=weather_response.UtcOffsetSeconds()))
-    forecast_cache_last_updated = forecast_cache_last_updated.astimezone(forecast_timezone)
-
-    forecast_data = process_weather_data(aqi_response, weather_response, weather_params, FORECAST_DAYS)
-
-    # Formatting
-    temp_unit = temp_unit[:1].upper()
-    precip_unit = precip_unit[:2]
-    if wind_speed_unit == "ms":
-        wind_speed_unit = "m/s"
-    precip_cutoff = 0.01 if precip_unit == "in" else 0.25
-
-    for forecast in forecast_data.iter_rows(named=True):
-        temp_max = forecast["temperature_max"]
-        temp_min = forecast["temperature_min"]
-        adj_temp_max = forecast["apparent_temperature_max"]
-        adj_temp_min = forecast["apparent_temperature_min"]
-        wmo_code = forecast["wmo"]
-        wmo = WMO_MAP[wmo_code]
-        weather_description = wmo[0]
-        weather_icon = wmo[1]
-        aqi = forecast["aqi_max"]
-        uvi = forecast["uv_index_max"]
-        wind_dir = forecast["vector_avg_wind_direction_10m"]
-
-        if wmo_code in [0, 1] and forecast["daylight_hours"] == 0:
-            weather_description = weather_description.replace("Sunny", "Clear")
-            weather_description = weather_description.replace("sunny", "clear")
-            weather_icon = "\U0001f319\ufe0f"
-
-        summary = f"{weather_icon} {temp_max:.0f}° | {temp_min:.0f}°, {weather_description}"
-
-        precip_description, max_precipitation = format_precipitation_description(forecast, precip_cutoff, precip_unit)
-
-        if max_precipitation > 0:
-            summary += f" ({format_float(max_precipitation)} {precip_unit})"
-
-        description = f"""\
-        Temperature: {temp_min:.0f}°{temp_unit} … {temp_max:.0f}°{temp_unit}
-        Feels like: {adj_temp_min:.0f}°{temp_unit} … {adj_temp_max:.0f}°{temp_unit}
-        Humidity: {forecast["relative_humidity_max"]:.0f}%
-
-        Air quality: {AQI_MAP[aqi]} ({aqi})
-        UV index: {UVI_MAP[uvi]} ({uvi})
-        Cloud cover: {forecast["cloud_cover_mean"]:.0f}%
-
-        {precip_description}
-
-        Wind: {forecast["wind_speed_mean"]} {wind_speed_unit} {WIND_DIR_MAP[wind_dir]} ({wind_dir}°)
-        Wind gust: {forecast["wind_gusts_max"]} {wind_speed_unit}
-
-        Weather data by Open-Meteo.com, CC BY 4.0
-
-        Updated: {datetime.strftime(forecast_cache_last_updated, "%a, %d %b %Y %I:%M%p")} {tz_abbreviation}
-        """
-
-        weather_data_dict["ForecastEntries"].append((forecast["date"], summary, clean_description(description)))
+    location_frames = process_locations_weather_data(aqi_responses, weather_responses, weather_params, FORECAST_DAYS)
+
+    multiple_locations = len(locations) > 1
+    # What the calendar shows, minus the "Updated" line that changes on every refresh
+    displayed_entries = []
+    for location_id, (lat, lon, location_string) in enumerate(locations):
+        weather_response = weather_responses[location_id]
+        location_geo = (lat, lon) if show_location else None
+        location_data = location_frames[location_id]
+
+        # Forecast local timezone
+        tz_abbreviation = weather_response.TimezoneAbbreviation().decode("utf-8")
+        utc_offset_seconds = weather_response.UtcOffsetSeconds()
+        forecast_timezone = timezone(timedelta(seconds=utc_offset_seconds))
+        updated = format_updated(forecast_cache_last_updated.astimezone(forecast_timezone), tz_abbreviation)
+
+        for forecast in location_data.iter_rows(named=True):
+            entry = format_forecast_entry(forecast, metric)
+            displayed_entries.append((*entry, location_string))
+            weather_data_dict["ForecastEntries"].append(
+                label_entry(entry, updated, location_string, location_geo, multiple_locations)
+            )
+
+        # Days that have passed are no longer in the response, keep serving them from the archive.
+        # Without any forecast rows there is nothing to archive and no current date to read past days from
+        if location_data.is_empty():
+            past_data = pl.DataFrame()
+        else:
+            try:
+                append_daily_rows(
+                    lat, lon, metric, location_data, forecast_cache_last_updated, utc_offset_seconds, tz_abbreviation
+                )
+                past_data = read_past_days(lat, lon, metric, today=location_data["date"].min())
+            except (OSError, pl.exceptions.PolarsError) as e:
+                print(f"Forecast archive unavailable: {e}")
+                past_data = pl.DataFrame()
+
+        for forecast in past_data.iter_rows(named=True):
+            archived_timezone = timezone(timedelta(seconds=forecast["utc_offset_seconds"]))
+            archived_updated = format_updated(
+                forecast["last_updated"].astimezone(archived_timezone), forecast["timezone_abbreviation"]
+            )
+            entry = format_forecast_entry(forecast, metric)
+            displayed_entries.append((*entry, location_string))
+            weather_data_dict["ArchivedEntries"].append(
+                label_entry(entry, archived_updated, location_string, location_geo, multiple_locations)
+            )
+
+    # A refresh usually only drops the hour that passed, keep the previous calendar if no value shown changed
+    weather_data_dict["Fingerprint"] = fingerprint_entries(displayed_entries)
+    if previous and previous["Fingerprint"] == weather_data_dict["Fingerprint"]:
+        print("Forecast values unchanged, keeping the previous calendar")
+        return {**previous, "Expires": expires, "ResponseFingerprint": response_fingerprint}
 
     return weather_data_dict
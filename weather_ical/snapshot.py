@@ -0,0 +1,137 @@
+"""Export and import the hot working set so a new instance starts with warm caches.
+
+Usage:
+    python -m weather_ical.snapshot export <path>
+    python -m weather_ical.snapshot import <path>
+
+Rendered calendars only live in the serving process, so they are included when exporting through the
+/admin/snapshot endpoint and restored when run.py imports the file named by CACHE_SNAPSHOT.
+
+Snapshots are pickled, so they are signed with an HMAC keyed on the ADMIN_TOKEN environment variable, and
+the signature is checked before anything is decompressed or unpickled. Exporting and importing require
+ADMIN_TOKEN to be set, to the same value on both instances.
+"""
+
+import argparse
+import hashlib
+import hmac
+import os
+import pickle
+import zlib
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+from requests_cache import SQLiteCache
+
+from weather_ical.constants import GEOCODING_CACHE_NAME, REQUEST_CACHE_NAME
+
+SNAPSHOT_MAGIC = b"WXICALSNAP2\n"
+SNAPSHOT_CACHE_NAMES = (GEOCODING_CACHE_NAME, REQUEST_CACHE_NAME)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def get_snapshot_key() -> bytes:
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token:
+        raise SnapshotError("ADMIN_TOKEN must be set to sign and verify cache snapshots")
+    return admin_token.encode("utf-8")
+
+
+def build_snapshot(calendars: dict[Any, Any] | None = None, key: bytes | None = None) -> bytes:
+    """Serialize unexpired cached responses and calendars into a compressed, signed blob."""
+    key = key or get_snapshot_key()
+    now = datetime.now(UTC)
+    caches = {}
+    for cache_name in SNAPSHOT_CACHE_NAMES:
+        cache = SQLiteCache(cache_name)
+        caches[cache_name] = {
+            response.cache_key: bytes(cache.responses.serialize(response)) for response in cache.filter(expired=False)
+        }
+
+    payload = {
+        "created_at": now,
+        "caches": caches,
+        "calendars": {
+            query_key: rendered for query_key, rendered in (calendars or {}).items() if rendered[0]["Expires"] > now
+        },
+    }
+
+    body = zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL), level=9)
+    return SNAPSHOT_MAGIC + hmac.digest(key, body, hashlib.sha256) + body
+
+
+def load_snapshot(data: bytes, calendars: dict[Any, Any] | None = None, key: bytes | None = None) -> dict[str, int]:
+    """Restore a snapshot built by build_snapshot, skipping entries that expired since it was taken."""
+    key = key or get_snapshot_key()
+    if not data.startswith(SNAPSHOT_MAGIC):
+        raise SnapshotError("Not a cache snapshot")
+
+    signature = data[len(SNAPSHOT_MAGIC) : len(SNAPSHOT_MAGIC) + 32]
+    body = data[len(SNAPSHOT_MAGIC) + 32 :]
+    # Nothing in the body is trusted until the signature matches
+    if not hmac.compare_digest(hmac.digest(key, body, hashlib.sha256), signature):
+        raise SnapshotError("Snapshot signature mismatch")
+
+    try:
+        payload = pickle.loads(zlib.decompress(body))
+    except (zlib.error, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        raise SnapshotError(f"Snapshot could not be read: {e}") from e
+    now = datetime.now(UTC)
+    counts = {}
+
+    for cache_name, entries in payload["caches"].items():
+        cache = SQLiteCache(cache_name)
+        counts[cache_name] = 0
+        with cache.responses.bulk_commit():
+            for cache_key, serialized in entries.items():
+                response = cache.responses.deserialize(cache_key, serialized)
+                if response is None or response.is_expired:
+                    continue
+                cache.save_response(response, cache_key=cache_key, expires=response.expires)
+                counts[cache_name] += 1
+
+    counts["calendars"] = 0
+    if calendars is not None:
+        for query_key, rendered in payload["calendars"].items():
+            if rendered[0]["Expires"] > now:
+                calendars[query_key] = rendered
+                counts["calendars"] += 1
+
+    return counts
+
+
+def export_snapshot(path: str | Path, calendars: dict[Any, Any] | None = None):
+    data = build_snapshot(calendars)
+    tmp_path = Path(path).with_suffix(".tmp")
+    tmp_path.write_bytes(data)
+    tmp_path.replace(path)
+    print(f"Exported cache snapshot to {path} ({len(data)} bytes)")
+
+
+def import_snapshot(path: str | Path, calendars: dict[Any, Any] | None = None) -> dict[str, int]:
+    counts = load_snapshot(Path(path).read_bytes(), calendars)
+    print(f"Imported cache snapshot from {path}: {counts}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import a cache snapshot")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            export_snapshot(args.path)
+        else:
+            import_snapshot(args.path)
+    except SnapshotError as e:
+        raise SystemExit(str(e))
+
+
+if __name__ == "__main__":
+    main()